@@ -12,10 +12,16 @@ Usage:
   python3 program_macropad.py --read                 # read current config from pad
   python3 program_macropad.py --led blue wave         # set all LEDs (color + effect)
   python3 program_macropad.py --dump                 # log sent packets to hex file
+  python3 program_macropad.py --legacy-delay         # fixed 200ms wait after each commit
+  python3 program_macropad.py --safe-commit          # commit after every layer config packet
 """
 
+import atexit
+import functools
+import itertools
 import json
 import os
+import struct
 import sys
 import time
 
@@ -26,11 +32,32 @@ except ImportError:
     print("Install pyusb: pip install pyusb", file=sys.stderr)
     sys.exit(1)
 
+try:
+    import usb1  # optional: pipelined async transfers (pip install libusb1)
+except ImportError:
+    usb1 = None
+
+try:
+    import ijson  # optional: streaming config parser (pip install ijson)
+except ImportError:
+    ijson = None
+
 # --- Device ---
 VENDOR_ID = 0x1189
 PRODUCT_ID = 0x8840
 REPORT_SIZE = 65  # 1 byte report ID + 64 bytes data
 
+# Fixed reports, built once
+_COMMIT_PACKET = bytes([0x03, 0xFD, 0xFE, 0xFF]) + bytes(REPORT_SIZE - 4)
+_SAVE_PACKET = bytes([0x03, 0xEF, 0x03]) + bytes(REPORT_SIZE - 3)
+
+# --- Commit timing ---
+# After a commit we wait for the device to answer on the IN endpoint (or time
+# out), so we only stall for as long as the device actually needs.
+COMMIT_ACK_TIMEOUT = 100  # ms to wait for an IN report after a commit
+COMMIT_DELAY = 0.005      # fixed wait when there is no IN endpoint
+LEGACY_COMMIT_DELAY = 0.2  # Windows app uses Sleep(200) after commits
+
 # --- Button IDs (1-based, 24 per layer) ---
 # On the 12-key + 2-knob model:
 #   Keys 1-12:  0x01-0x0C
@@ -49,6 +76,15 @@ MODIFIER = {
     "meta": 0x08, "win": 0x08, "cmd": 0x08, "gui": 0x08,
 }
 
+# Pretty-print prefix for each low-nibble modifier byte, e.g. 0x03 -> "ctrl+shift+"
+_MOD_PREFIX = []
+for _m in range(16):
+    _MOD_PREFIX.append(
+        ("ctrl+" if _m & 0x01 else "") + ("shift+" if _m & 0x02 else "")
+        + ("alt+" if _m & 0x04 else "") + ("meta+" if _m & 0x08 else "")
+    )
+del _m
+
 # --- HID key codes ---
 KEY = {
     "none": 0x00,
@@ -77,8 +113,16 @@ KEY = {
     "mute": 0x7F, "volume_up": 0x80, "volume_down": 0x81,
 }
 
-# Reverse lookup for pretty-printing
-_KEY_NAME = {v: k for k, v in KEY.items() if v != 0}
+# Reverse lookup for pretty-printing, indexed by keycode byte (None if unnamed).
+# The first alias wins, so 0x28 prints as "enter" rather than "return".
+_KEY_NAME = [None] * 256
+for _name, _code in KEY.items():
+    if _code and _KEY_NAME[_code] is None:
+        _KEY_NAME[_code] = _name
+
+# Exact-match key lookup for the hot path; _keycode only normalizes
+# (lower/strip) on a miss and remembers the spelling it saw.
+_KEY_LUT = dict(KEY)
 
 # --- Button name <-> ID mapping (for JSON config) ---
 
@@ -89,7 +133,11 @@ BUTTON_NAMES = {
     "knob1_left": 0x15, "knob1_press": 0x14, "knob1_right": 0x13,
     "knob2_left": 0x10, "knob2_press": 0x11, "knob2_right": 0x12,
 }
-_BUTTON_ID_TO_NAME = {v: k for k, v in BUTTON_NAMES.items()}
+# Indexed by button id byte (None if unnamed)
+_BUTTON_ID_TO_NAME = [None] * 256
+for _name, _code in BUTTON_NAMES.items():
+    _BUTTON_ID_TO_NAME[_code] = _name
+del _name, _code
 
 # --- LED presets: byte = (color << 4) | effect ---
 
@@ -105,6 +153,11 @@ LED_EFFECTS = {
 _LED_COLOR_NAME = {v: k for k, v in LED_COLORS.items()}
 _LED_EFFECT_NAME = {v: k for k, v in LED_EFFECTS.items()}
 
+# Name tables extended with numeric strings ("0"-"15") for _resolve_led
+_NUMERIC_LED = {str(i): i for i in range(16)}
+_LED_COLORS_EXT = {**_NUMERIC_LED, **LED_COLORS}
+_LED_EFFECTS_EXT = {**_NUMERIC_LED, **LED_EFFECTS}
+
 
 def parse_led_config(layer_dict):
     """
@@ -128,28 +181,27 @@ def parse_led_config(layer_dict):
     raise ValueError(f"Invalid led config: {led!r}")
 
 
-def _resolve_led_color(val):
-    """Resolve color name, int, or numeric string to color index 0-7."""
+def _resolve_led(val, table, what, names):
+    """Resolve a name, int, or numeric string through an extended LED table."""
     if isinstance(val, int):
         return val & 0x0F
     val = val.lower().strip()
-    if val in LED_COLORS:
-        return LED_COLORS[val]
-    if val.isdigit():
-        return int(val) & 0x0F
-    raise ValueError(f"Unknown LED color {val!r}. Known: {', '.join(LED_COLORS.keys())} (or 0-7)")
+    index = table.get(val)
+    if index is None:
+        if val.isdigit():  # numbers past the table, e.g. "17"
+            return int(val) & 0x0F
+        raise ValueError(f"Unknown LED {what} {val!r}. Known: {', '.join(names)} (or 0-7)")
+    return index
+
+
+def _resolve_led_color(val):
+    """Resolve color name, int, or numeric string to color index 0-7."""
+    return _resolve_led(val, _LED_COLORS_EXT, "color", LED_COLORS)
 
 
 def _resolve_led_effect(val):
     """Resolve effect name, int, or numeric string to effect index 0-7."""
-    if isinstance(val, int):
-        return val & 0x0F
-    val = val.lower().strip()
-    if val in LED_EFFECTS:
-        return LED_EFFECTS[val]
-    if val.isdigit():
-        return int(val) & 0x0F
-    raise ValueError(f"Unknown LED effect {val!r}. Known: {', '.join(LED_EFFECTS.keys())} (or 0-7)")
+    return _resolve_led(val, _LED_EFFECTS_EXT, "effect", LED_EFFECTS)
 
 
 def make_led_byte(effect, color):
@@ -194,29 +246,39 @@ DEFAULT_CONFIG = {
 def _parse_single_binding(value):
     """Parse one keystroke: "a", "ctrl+c", "ctrl", or {"key": "c", "mod": "ctrl"}."""
     if isinstance(value, str):
-        if "+" in value:
-            parts = value.lower().split("+")
-            mod_val = 0
-            for p in parts[:-1]:
-                p = p.strip()
-                if p not in MODIFIER:
-                    raise ValueError(f"Unknown modifier {p!r}. Known: {', '.join(MODIFIER.keys())}")
-                mod_val |= MODIFIER[p]
-            last = parts[-1].strip()
-            # Last part can be a key ("ctrl+c") or another modifier ("ctrl+shift")
-            if last in MODIFIER:
-                mod_val |= MODIFIER[last]
-                return ("none", mod_val)
-            return (last, mod_val)
-        # Bare modifier name (e.g. "ctrl") -> modifier-only, no keycode
-        if value.lower().strip() in MODIFIER:
-            return ("none", MODIFIER[value.lower().strip()])
-        return (value, 0)
+        return _parse_key_string(value)
     if isinstance(value, dict):
         return (value.get("key", "none"), value.get("mod", 0))
     raise ValueError(f"Invalid binding: {value!r}")
 
 
+@functools.lru_cache(maxsize=256)
+def _parse_key_string(value):
+    """Parse a string keystroke; memoized since layers repeat the same bindings."""
+    mod_val = MODIFIER.get(value)
+    if mod_val is not None:
+        # Bare modifier name (e.g. "ctrl") -> modifier-only, no keycode
+        return ("none", mod_val)
+    if "+" in value:
+        parts = value.lower().split("+")
+        mod_val = 0
+        for p in parts[:-1]:
+            p = p.strip()
+            if p not in MODIFIER:
+                raise ValueError(f"Unknown modifier {p!r}. Known: {', '.join(MODIFIER.keys())}")
+            mod_val |= MODIFIER[p]
+        last = parts[-1].strip()
+        # Last part can be a key ("ctrl+c") or another modifier ("ctrl+shift")
+        if last in MODIFIER:
+            mod_val |= MODIFIER[last]
+            return ("none", mod_val)
+        return (last, mod_val)
+    name = value.lower().strip()
+    if name in MODIFIER:
+        return ("none", MODIFIER[name])
+    return (value, 0)
+
+
 def parse_binding(value):
     """
     Parse a button binding from JSON into a list of (key, modifier) tuples.
@@ -228,51 +290,109 @@ def parse_binding(value):
     return [_parse_single_binding(value)]
 
 
+_NEW_LAYERS = (None, None)  # from _iter_layers: a top-level "layers" object starts
+
+
+def _iter_layers(f):
+    """
+    Yield (layer_str, layer_dict) from a config file, streaming with ijson if
+    available. The streaming parser sees every top-level "layers" key, so it
+    yields _NEW_LAYERS before each one; only the last counts, as in json.load.
+    """
+    if ijson is not None:
+        yield from _iter_layers_streaming(f)
+        return
+    raw = json.load(f)
+    if not isinstance(raw, dict):
+        raise ValueError("Invalid config: expected a JSON object")
+    layers = raw.get("layers", {})
+    if not isinstance(layers, dict):
+        raise ValueError("Invalid layers config: expected an object")
+    yield from layers.items()
+
+
+def _iter_layers_streaming(f):
+    """ijson version of _iter_layers: builds one layer dict at a time."""
+    layer_key = None
+    builder = None
+    depth = 0  # open containers inside the layer value being built
+    # use_float: plain ints/floats instead of Decimal, like json.load
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event in ("start_map", "start_array"):
+                depth += 1
+            elif event in ("end_map", "end_array"):
+                depth -= 1
+            if depth == 0:
+                yield layer_key, builder.value
+                builder = None
+        elif prefix == "":
+            if event == "map_key" and value == "layers":
+                yield _NEW_LAYERS
+            elif event not in ("start_map", "map_key", "end_map"):
+                raise ValueError("Invalid config: expected a JSON object")
+        elif prefix == "layers":
+            if event == "map_key":
+                layer_key = value
+                builder = ijson.ObjectBuilder()
+            elif event not in ("start_map", "end_map"):
+                raise ValueError("Invalid layers config: expected an object")
+
+
 def load_config(path):
     """
     Load a JSON config file.
 
     Returns (bindings, leds, delays) where:
-      bindings: {layer_int: [(button_id, [(key, mod), ...]), ...]}
+      bindings: [(layer_int, [(button_id, [(mod_byte, keycode), ...]), ...]), ...] sorted by layer
       leds: {layer_int: (effect, color)}
       delays: {layer_int: delay_ms}
     """
-    with open(path) as f:
-        raw = json.load(f)
-
-    layers_data = raw.get("layers", {})
-    bindings = {}
-    leds = {}
-    delays = {}
-
-    for layer_str, layer_dict in layers_data.items():
-        layer_num = int(layer_str)
-        if layer_num < 1 or layer_num > NUM_LAYERS:
-            print(f"  Warning: ignoring layer {layer_num} (must be 1-{NUM_LAYERS})", file=sys.stderr)
-            continue
-
-        # Extract LED config (if present)
-        led_cfg = parse_led_config(layer_dict)
-        if led_cfg is not None:
-            leds[layer_num] = led_cfg
-
-        # Extract macro delay (if present)
-        delay = layer_dict.get("delay")
-        if delay is not None:
-            delays[layer_num] = int(delay)
-
-        # Extract button bindings (skip non-button keys like "led", "delay", etc.)
-        layer_bindings = []
-        for btn_name, value in layer_dict.items():
-            btn_name_lower = btn_name.lower().strip()
-            if btn_name_lower not in BUTTON_NAMES:
+    # {layer_int: (layer_bindings, led_cfg, delay)}. A repeated layer replaces
+    # all three, so ijson (which yields duplicate keys) matches json.load.
+    layers = {}
+
+    with open(path, "rb") as f:
+        for layer_str, layer_dict in _iter_layers(f):
+            if (layer_str, layer_dict) == _NEW_LAYERS:
+                layers.clear()
+                continue
+            if not isinstance(layer_dict, dict):
+                raise ValueError(f"Invalid config for layer {layer_str!r}: expected an object")
+            layer_num = int(layer_str)
+            if layer_num < 1 or layer_num > NUM_LAYERS:
+                print(f"  Warning: ignoring layer {layer_num} (must be 1-{NUM_LAYERS})", file=sys.stderr)
                 continue
-            btn_id = BUTTON_NAMES[btn_name_lower]
-            keys = parse_binding(value)
-            layer_bindings.append((btn_id, keys))
 
-        bindings[layer_num] = layer_bindings
+            # Extract LED config (if present)
+            led_cfg = parse_led_config(layer_dict)
 
+            # Extract macro delay (if present)
+            delay = layer_dict.get("delay")
+            if delay is not None:
+                delay = int(delay)
+
+            # Extract button bindings (skip non-button keys like "led", "delay", etc.)
+            layer_bindings = []
+            for btn_name, value in layer_dict.items():
+                # Exact match first; only normalize names that miss
+                btn_id = BUTTON_NAMES.get(btn_name) or BUTTON_NAMES.get(btn_name.lower().strip())
+                if btn_id is None:
+                    continue
+                keys = [(_modifier(m) & 0xFF, _keycode(k) & 0xFF) for k, m in parse_binding(value)]
+                if len(keys) > _MAX_KEYS_PER_BUTTON:
+                    raise ValueError(
+                        f"Layer {layer_num} {btn_name}: macro has {len(keys)} keys, "
+                        f"max {_MAX_KEYS_PER_BUTTON}"
+                    )
+                layer_bindings.append((btn_id, keys))
+
+            layers[layer_num] = (layer_bindings, led_cfg, delay)
+
+    bindings = [(layer_num, layer[0]) for layer_num, layer in sorted(layers.items())]
+    leds = {layer_num: layer[1] for layer_num, layer in layers.items() if layer[1] is not None}
+    delays = {layer_num: layer[2] for layer_num, layer in layers.items() if layer[2] is not None}
     return bindings, leds, delays
 
 
@@ -288,39 +408,255 @@ def generate_config(path):
 
 def _keycode(k):
     """Resolve key name (str) or int to HID keycode int."""
+    if type(k) is int:
+        return k
+    try:
+        return _KEY_LUT[k]
+    except (KeyError, TypeError):
+        pass
     if isinstance(k, str):
-        k = k.lower().strip()
-        if k not in KEY:
-            raise KeyError(f"Unknown key {k!r}. Known keys: {', '.join(sorted(KEY.keys()))}")
-        return KEY[k]
+        name = k.lower().strip()
+        if name not in KEY:
+            raise KeyError(f"Unknown key {name!r}. Known keys: {', '.join(sorted(KEY.keys()))}")
+        _KEY_LUT[k] = KEY[name]
+        return KEY[name]
     return int(k)
 
 
 def _modifier(m):
     """Resolve modifier name (str) or int to modifier byte."""
+    if type(m) is int:
+        return m
+    try:
+        return MODIFIER[m]
+    except (KeyError, TypeError):
+        pass
     if isinstance(m, str):
         return MODIFIER.get(m.lower().strip(), 0)
     return int(m or 0)
 
 
+def _pad_or_check(buf):
+    """Return buf zero-padded to REPORT_SIZE bytes; longer input is a builder bug."""
+    if len(buf) > REPORT_SIZE:
+        raise ValueError(f"Report is {len(buf)} bytes, expected at most {REPORT_SIZE}")
+    return bytes(buf).ljust(REPORT_SIZE, b"\x00")
+
+
 def make_report(*first_bytes):
     """Build a 65-byte report: first_bytes + zero-padding."""
-    data = list(first_bytes) + [0] * (REPORT_SIZE - len(first_bytes))
-    return bytes(data[:REPORT_SIZE])
+    return _pad_or_check(first_bytes)
+
+
+DUMP_SENT_PACKETS = None  # open file to log packets to (--dump)
 
+# Scratch report for packets built on the fly. send() never keeps a reference
+# (pyusb copies synchronously, AsyncSender copies on submit), so it is reused.
+_PACKET_BUF = bytearray(REPORT_SIZE)
+_ZERO_REPORT = bytes(REPORT_SIZE)
 
-DUMP_SENT_PACKETS = None  # set to a file path to log packets (--dump)
 
+USE_LEGACY_DELAY = False  # sleep LEGACY_COMMIT_DELAY after commits (--legacy-delay)
+SAFE_COMMIT = False  # commit after each layer config packet, not once per batch (--safe-commit)
+
+
+def send(ep, data):
+    """
+    Send one 65-byte report to the interrupt OUT endpoint.
 
-def send(ep, data: bytes):
-    """Send one 65-byte report to the interrupt OUT endpoint."""
-    assert len(data) == REPORT_SIZE
-    if DUMP_SENT_PACKETS:
-        with open(DUMP_SENT_PACKETS, "a") as f:
-            f.write(data.hex() + "\n")
+    data may be any bytes-like object, including a memoryview of the shared
+    _PACKET_BUF scratch report. The length is guaranteed by the packet
+    builders, not re-checked here.
+    """
+    if DUMP_SENT_PACKETS is not None:
+        DUMP_SENT_PACKETS.write(data.hex())
+        DUMP_SENT_PACKETS.write("\n")
     ep.write(data, timeout=2000)
 
 
+def flush(ep):
+    """Block until all queued reports have reached the device (no-op for pyusb)."""
+    if isinstance(ep, AsyncSender):
+        ep.flush()
+
+
+def wait_for_commit(ep, ep_in):
+    """Wait until the device has processed a commit (ACK on IN, or a short delay)."""
+    flush(ep)  # the commit must be on the device before we wait for its ACK
+    if USE_LEGACY_DELAY:
+        time.sleep(LEGACY_COMMIT_DELAY)
+    elif ep_in is None:
+        time.sleep(COMMIT_DELAY)
+    else:
+        try:
+            ep_in.read(REPORT_SIZE, timeout=COMMIT_ACK_TIMEOUT)
+        except usb.core.USBTimeoutError:
+            pass
+
+
+def drain_in(ep_in, timeout=10):
+    """Discard IN reports the device is still holding (e.g. unread commit ACKs)."""
+    while True:
+        try:
+            ep_in.read(REPORT_SIZE, timeout=timeout)
+        except usb.core.USBTimeoutError:
+            return
+
+
+# --- Async I/O (optional, via libusb1) ---
+
+ASYNC_DEPTH = 8  # interrupt OUT transfers kept in flight (fits the 6-packet layer config batch + commit)
+
+
+class AsyncSender:
+    """
+    Interrupt OUT endpoint backed by a pool of libusb1 async transfers.
+
+    write() submits and returns immediately; transfers on one endpoint
+    complete in submission order. Every commit still goes through
+    wait_for_commit(), which flushes the pool and waits for the ACK on IN,
+    so button writes pace exactly like the pyusb path. Packets only overlap
+    between commits, i.e. in the batched layer config packets.
+    """
+
+    def __init__(self, context, handle, address, depth=ASYNC_DEPTH):
+        self.bEndpointAddress = address
+        self._context = context
+        self._handle = handle
+        self._idle = [handle.getTransfer() for _ in range(depth)]
+        self._in_flight = 0
+        self._failed = None
+
+    def _on_done(self, transfer):
+        self._in_flight -= 1
+        self._idle.append(transfer)
+        status = transfer.getStatus()
+        if status != usb1.TRANSFER_COMPLETED and self._failed is None:
+            self._failed = status
+
+    def _check(self):
+        if self._failed is not None:
+            status, self._failed = self._failed, None
+            raise usb.core.USBError(f"Async transfer to 0x{self.bEndpointAddress:02x} failed (status {status})")
+
+    def write(self, data, timeout=2000):
+        while not self._idle:
+            self._context.handleEvents()
+        self._check()
+        transfer = self._idle.pop()
+        transfer.setInterrupt(self.bEndpointAddress, bytes(data), callback=self._on_done, timeout=timeout)
+        transfer.submit()
+        self._in_flight += 1
+        return len(data)
+
+    def flush(self):
+        while self._in_flight:
+            self._context.handleEvents()
+        self._check()
+
+
+class AsyncReceiver:
+    """Interrupt IN endpoint sharing an AsyncSender's libusb1 handle."""
+
+    def __init__(self, context, handle, address):
+        self.bEndpointAddress = address
+        self._context = context
+        self._handle = handle
+
+    def read(self, size, timeout=1000):
+        try:
+            return self._handle.interruptRead(self.bEndpointAddress, size, timeout=timeout)
+        except usb1.USBErrorTimeout:
+            raise usb.core.USBTimeoutError("Operation timed out", errno=110)
+
+    def read_burst(self, count, size, request=None, opcode=None, timeout=1000):
+        """
+        Pre-submit `count` IN transfers, call request() (e.g. to send the
+        query on OUT), then collect reports until all have arrived or
+        `timeout` ms have passed. Returns the reports in arrival order.
+        If opcode is given, reports whose byte 1 differs are stale: they are
+        dropped and their transfer is resubmitted, so they don't count.
+        """
+        reports = []
+        pending = []
+        deadline = time.monotonic() + timeout / 1000
+
+        def on_done(transfer):
+            if transfer.getStatus() == usb1.TRANSFER_COMPLETED:
+                data = bytes(transfer.getBuffer()[:transfer.getActualLength()])
+                if opcode is None or (len(data) > 1 and data[1] == opcode):
+                    reports.append(data)
+                elif time.monotonic() < deadline:
+                    transfer.submit()  # stale report; keep listening
+                    return
+            pending.remove(transfer)
+
+        for _ in range(count):
+            transfer = self._handle.getTransfer()
+            transfer.setInterrupt(self.bEndpointAddress, size, callback=on_done)
+            transfer.submit()
+            pending.append(transfer)
+
+        if request is not None:
+            request()
+
+        while pending and time.monotonic() < deadline:
+            self._context.handleEventsTimeout(0.05)
+
+        # Cancel whatever the device didn't answer and reap the callbacks
+        for transfer in list(pending):
+            try:
+                transfer.cancel()
+            except usb1.USBErrorNotFound:
+                pass  # completed in the meantime
+        while pending:
+            self._context.handleEvents()
+        return reports
+
+
+def open_async_endpoints(dev, ep_out, ep_in):
+    """
+    Reopen a configured pyusb device through libusb1 for pipelined I/O.
+    Returns (AsyncSender, AsyncReceiver or None).
+    """
+    interfaces = {ep_out.interface}
+    if ep_in is not None:
+        interfaces.add(ep_in.interface)
+    usb.util.dispose_resources(dev)  # release pyusb's handle before libusb1 claims
+
+    context = usb1.USBContext()
+    handle = context.openByVendorIDAndProductID(VENDOR_ID, PRODUCT_ID)
+    if handle is None:
+        context.close()
+        raise usb1.USBErrorNoDevice()
+    try:
+        try:
+            handle.setAutoDetachKernelDriver(True)
+        except usb1.USBErrorNotSupported:
+            pass
+        for i in sorted(interfaces):
+            handle.claimInterface(i)
+    except usb1.USBError:
+        handle.close()
+        context.close()
+        raise
+
+    def close():
+        for i in sorted(interfaces):
+            try:
+                handle.releaseInterface(i)
+            except usb1.USBError:
+                pass
+        handle.close()
+        context.close()
+
+    atexit.register(close)
+
+    sender = AsyncSender(context, handle, ep_out.bEndpointAddress)
+    receiver = AsyncReceiver(context, handle, ep_in.bEndpointAddress) if ep_in is not None else None
+    return sender, receiver
+
+
 # --- Endpoint discovery ---
 
 def _find_endpoint(dev, direction, transfer_type=usb.util.ENDPOINT_TYPE_INTR):
@@ -350,100 +686,106 @@ def find_in_endpoint(dev):
 
 # --- Per-button write ---
 
-def write_button(ep, button_id, layer, keys):
-    """Write one button binding and commit (200ms delay)."""
-    # Resolve all keys
-    resolved = []
-    for k, m in keys:
-        resolved.append((_modifier(m), _keycode(k)))
-
-    key_count = len(resolved)
-    if key_count == 0:
-        key_count = 1
-        resolved = [(0, 0)]
-
-    # Build the write packet
-    #   Bytes 0-8: 03 fd <button> <layer> 01 00 00 00 00
-    #   Byte 9:    00 (padding, required)
-    #   Byte 10:   type/count (01 for single key, N for N-key macro)
-    #   Bytes 11+: (mod, keycode) pairs
-    payload = [
-        0x03, 0xFD,
-        button_id & 0xFF,
-        layer & 0xFF,
-        0x01, 0x00, 0x00, 0x00, 0x00,  # bytes 4-8
-        0x00,                            # byte 9: padding
-        key_count & 0xFF,                # byte 10: type/count
-    ]
-    for mod_byte, kc in resolved:
-        payload.append(mod_byte & 0xFF)
-        payload.append(kc & 0xFF)
-
-    # Pad to 65 bytes
-    payload += [0] * (REPORT_SIZE - len(payload))
-    send(ep, bytes(payload[:REPORT_SIZE]))
+_BUTTON_HEADER = struct.Struct("<11B")
+_MAX_KEYS_PER_BUTTON = (REPORT_SIZE - _BUTTON_HEADER.size) // 2
 
-    # Commit
-    send(ep, make_report(0x03, 0xFD, 0xFE, 0xFF))
-
-    # Delay (Windows app uses Sleep(200) after commits)
-    time.sleep(0.2)
 
+def _build_button_packet(button_id, layer, resolved):
+    """
+    Build the write packet for one button from [(mod_byte, keycode), ...]
+    (bytes already masked to 0-255, as load_config produces them).
 
-def write_layer_config(ep, layer, config_byte, config_data=None):
+      Bytes 0-8: 03 fd <button> <layer> 01 00 00 00 00
+      Byte 9:    00 (padding, required)
+      Byte 10:   type/count (01 for single key, N for N-key macro)
+      Bytes 11+: (mod, keycode) pairs
+    """
+    assert resolved, "unbound buttons are skipped by the caller"
+    if len(resolved) > _MAX_KEYS_PER_BUTTON:
+        raise ValueError(f"Macro has {len(resolved)} keys, max {_MAX_KEYS_PER_BUTTON}")
+
+    buf = bytearray(REPORT_SIZE)
+    _BUTTON_HEADER.pack_into(
+        buf, 0,
+        0x03, 0xFD, button_id & 0xFF, layer & 0xFF,
+        0x01, 0x00, 0x00, 0x00, 0x00,  # bytes 4-8
+        0x00,                            # byte 9: padding
+        len(resolved) & 0xFF,            # byte 10: type/count
+    )
+    pairs = bytes(itertools.chain.from_iterable(resolved))
+    buf[_BUTTON_HEADER.size:_BUTTON_HEADER.size + len(pairs)] = pairs
+    return bytes(buf)
+
+
+def commit(ep, ep_in=None):
+    """Send the commit packet (03 fd fe ff) and wait for the device to ACK."""
+    if ep_in is not None and not USE_LEGACY_DELAY:
+        # An ACK that arrived after an earlier wait timed out must not
+        # satisfy this one, or every later wait would be off by one.
+        drain_in(ep_in, timeout=1)
+    send(ep, _COMMIT_PACKET)
+    wait_for_commit(ep, ep_in)
+
+
+def _send_layer_config(ep, layer, config_byte, config_data=None):
+    """Send 03 fe b0 <layer> <config_byte> + 60 bytes (no commit)."""
+    buf = _PACKET_BUF
+    buf[:] = _ZERO_REPORT
+    buf[0:5] = (0x03, 0xFE, 0xB0, layer & 0xFF, config_byte & 0xFF)
+    if config_data is not None:
+        config_data = config_data[:60]
+        buf[5:5 + len(config_data)] = config_data
+    send(ep, memoryview(buf))
+
+
+def write_layer_config(ep, layer, config_byte, config_data=None, ep_in=None):
     """Send 03 fe b0 <layer> <config_byte> + 60 bytes, then commit."""
-    if config_data is None:
-        config_data = bytes(60)
-    else:
-        config_data = bytes(config_data[:60])
-        config_data += bytes(60 - len(config_data))
-
-    payload = [0x03, 0xFE, 0xB0, layer & 0xFF, config_byte & 0xFF] + list(config_data)
-    payload = payload[:REPORT_SIZE]
-    send(ep, bytes(payload))
-
-    # Commit
-    send(ep, make_report(0x03, 0xFD, 0xFE, 0xFF))
-    time.sleep(0.2)
+    _send_layer_config(ep, layer, config_byte, config_data)
+    commit(ep, ep_in)
 
 
-def write_macro_delay(ep, layer, delay_ms):
+def write_macro_delay(ep, layer, delay_ms, ep_in=None):
     """Set the macro keystroke delay for a layer (0 to disable)."""
     delay_ms = max(0, min(0xFFFF, int(delay_ms)))
-    payload = [
+    buf = _PACKET_BUF
+    buf[:] = _ZERO_REPORT
+    buf[0:7] = (
         0x03, 0xFD, 0x00, layer & 0xFF,
         0x05, delay_ms & 0xFF, (delay_ms >> 8) & 0xFF,
-    ]
-    payload += [0] * (REPORT_SIZE - len(payload))
-    send(ep, bytes(payload[:REPORT_SIZE]))
-    send(ep, make_report(0x03, 0xFD, 0xFE, 0xFF))
-    time.sleep(0.2)
+    )
+    send(ep, memoryview(buf))
+    commit(ep, ep_in)
 
 
-def write_all_layer_configs(ep, layers, leds=None, led_only=False):
+def write_all_layer_configs(ep, layers, leds=None, led_only=False, ep_in=None):
     """
-    Send layer configs for each programmed layer.
+    Send layer configs for each programmed layer (layers: ascending layer numbers).
 
     0x08 packet carries LED settings (byte 12 = (color << 4) | effect).
     0x05 packet carries other layer config (skipped in LED-only mode).
+    All packets share one commit at the end unless SAFE_COMMIT is set.
     """
     if leds is None:
         leds = {}
 
-    for layer in sorted(layers):
+    for layer in layers:
         # Build 0x08 config (carries LED settings)
         config_data_08 = bytearray(60)
         config_data_08[5] = 0x01
         led_cfg = leds.get(layer)
         if led_cfg:
             effect, color = led_cfg
-            config_data_08[7] = make_led_byte(effect, color)
+            # Already masked to 0-15 by _resolve_led_*, so no make_led_byte call
+            config_data_08[7] = (color << 4) | effect
             led_desc = f"{_LED_EFFECT_NAME.get(effect, str(effect))} {_LED_COLOR_NAME.get(color, str(color))}"
         else:
             config_data_08[7] = 0x11  # default: static red
             led_desc = "static red (default)"
 
-        write_layer_config(ep, layer, 0x08, config_data_08)
+        if SAFE_COMMIT:
+            write_layer_config(ep, layer, 0x08, config_data_08, ep_in=ep_in)
+        else:
+            _send_layer_config(ep, layer, 0x08, config_data_08)
 
         if not led_only:
             # 0x05 config (other layer settings -- NOT LED)
@@ -452,20 +794,42 @@ def write_all_layer_configs(ep, layers, leds=None, led_only=False):
             config_data_05[0] = 0xd0
             config_data_05[5] = 0x01
             config_data_05[7] = 0x10  # original capture value (not LED-related)
-            write_layer_config(ep, layer, 0x05, config_data_05)
+            if SAFE_COMMIT:
+                write_layer_config(ep, layer, 0x05, config_data_05, ep_in=ep_in)
+            else:
+                _send_layer_config(ep, layer, 0x05, config_data_05)
 
         print(f"    Layer {layer}: LED={led_desc}")
 
+    if layers and not SAFE_COMMIT:
+        commit(ep, ep_in)
+
 
 def save_to_board(ep):
     """Persist configuration to device flash: 03 ef 03."""
-    send(ep, make_report(0x03, 0xEF, 0x03))
+    send(ep, _SAVE_PACKET)
+    flush(ep)
     time.sleep(0.2)
     print("  Save to board sent (03 ef 03)")
 
 
 # --- Read current config ---
 
+def _read_reports(ep_in, count, opcode, timeout=1000):
+    """
+    Yield up to `count` IN reports whose byte 1 is opcode, stopping at the
+    first timeout. Other (stale) reports are skipped and don't count.
+    """
+    while count:
+        try:
+            data = ep_in.read(REPORT_SIZE, timeout=timeout)
+        except usb.core.USBTimeoutError:
+            return
+        if len(data) > 1 and data[1] == opcode:
+            count -= 1
+            yield data
+
+
 def read_all_buttons(ep_out, ep_in, layer):
     """
     Read all 24 button bindings for one layer.
@@ -474,14 +838,24 @@ def read_all_buttons(ep_out, ep_in, layer):
     Returns dict: {button_id: (type, [(mod, keycode), ...])}
     layer: 1-based (1, 2, 3)
     """
-    send(ep_out, make_report(0x03, 0xFA, 0x0F, 0x03, layer & 0xFF, 0x05))
+    query = make_report(0x03, 0xFA, 0x0F, 0x03, layer & 0xFF, 0x05)
+
+    def request():
+        send(ep_out, query)
+        flush(ep_out)
+
+    flush(ep_out)
+    drain_in(ep_in)  # leftovers would otherwise take a response slot
+
+    if isinstance(ep_in, AsyncReceiver):
+        # All IN transfers are queued before the query goes out
+        reports = ep_in.read_burst(BUTTONS_PER_LAYER, REPORT_SIZE, request=request, opcode=0xFA)
+    else:
+        request()
+        reports = _read_reports(ep_in, BUTTONS_PER_LAYER, 0xFA)
 
     result = {}
-    for _ in range(BUTTONS_PER_LAYER):
-        try:
-            data = ep_in.read(REPORT_SIZE, timeout=1000)
-        except usb.core.USBTimeoutError:
-            break
+    for data in reports:
         if len(data) < 13:
             continue
         # Response layout matches write: 03 fa <btn> <layer> 01 00 00 00 00 00 <type> <mod> <key> ...
@@ -499,6 +873,11 @@ def read_all_buttons(ep_out, ep_in, layer):
 
 def print_config(ep_out, ep_in):
     """Read and print the full device config (all layers)."""
+    # Bind lookup tables to locals for the inner loops
+    key_name = _KEY_NAME
+    button_name = _BUTTON_ID_TO_NAME
+    mod_prefix = _MOD_PREFIX
+
     for layer in range(1, NUM_LAYERS + 1):
         print(f"\n  Layer {layer}:")
         buttons = read_all_buttons(ep_out, ep_in, layer)
@@ -511,67 +890,61 @@ def print_config(ep_out, ep_in):
                 continue  # skip unbound
             names = []
             for mod, kc in keys:
-                mod_str = ""
-                if mod & 0x01: mod_str += "ctrl+"
-                if mod & 0x02: mod_str += "shift+"
-                if mod & 0x04: mod_str += "alt+"
-                if mod & 0x08: mod_str += "meta+"
-                key_str = _KEY_NAME.get(kc, f"0x{kc:02x}")
-                names.append(f"{mod_str}{key_str}")
-            btn_name = _BUTTON_ID_TO_NAME.get(btn_id, f"button 0x{btn_id:02x}")
+                key_str = key_name[kc] or f"0x{kc:02x}"
+                names.append(mod_prefix[mod & 0x0F] + key_str)
+            btn_name = button_name[btn_id] or f"button 0x{btn_id:02x}"
             binding_str = ', '.join(names) if names else "(unbound)"
             print(f"    {btn_name}: {binding_str}")
 
 
 # --- Program all buttons ---
 
-def program_from_config(ep, config, leds=None, delays=None):
-    """Program buttons, macro delays, and layer configs from parsed config."""
+def program_from_config(ep, config, leds=None, delays=None, ep_in=None):
+    """Program buttons, macro delays, and layer configs from load_config's sorted bindings."""
     if delays is None:
         delays = {}
 
     total = 0
-    for layer_num in sorted(config.keys()):
-        bindings = config[layer_num]
+    for layer_num, bindings in config:
         print(f"  Programming layer {layer_num} ({len(bindings)} buttons)...")
+
+        # Build every packet up front so the send loop only moves bytes
+        packets = []
         for btn_id, keys in bindings:
-            # Skip unbound
-            if len(keys) == 1:
-                kc = _keycode(keys[0][0])
-                if kc == 0 and _modifier(keys[0][1]) == 0:
-                    continue
+            # Skip unbound (no keys, or nothing but "none")
+            if all(pair == (0, 0) for pair in keys):
+                continue
+            btn_name = _BUTTON_ID_TO_NAME[btn_id] or f"0x{btn_id:02x}"
+            desc = f"{btn_name} -> {_describe_keys(keys)}"
+            packets.append((desc, _build_button_packet(btn_id, layer_num, keys)))
 
-            write_button(ep, btn_id, layer_num, keys)
+        for desc, packet in packets:
+            send(ep, packet)
+            commit(ep, ep_in)
             total += 1
-
-            btn_name = _BUTTON_ID_TO_NAME.get(btn_id, f"0x{btn_id:02x}")
-            key_desc = _describe_keys(keys)
-            print(f"    {btn_name} -> {key_desc}")
+            print(f"    {desc}")
 
         # Set macro delay for this layer
         if layer_num in delays:
             delay_ms = delays[layer_num]
-            write_macro_delay(ep, layer_num, delay_ms)
+            write_macro_delay(ep, layer_num, delay_ms, ep_in=ep_in)
             print(f"    macro delay: {delay_ms}ms")
 
     print(f"  Wrote {total} buttons total.")
 
     # Send layer configs with LED settings (required by capture protocol)
     print("  Sending layer configs...")
-    write_all_layer_configs(ep, sorted(config.keys()), leds=leds)
+    write_all_layer_configs(ep, [layer_num for layer_num, _ in config], leds=leds, ep_in=ep_in)
 
 
 def _describe_keys(keys):
-    """Pretty-print a list of (key, mod) tuples."""
+    """Pretty-print a list of resolved (mod, keycode) tuples."""
+    key_name = _KEY_NAME
+    mod_prefix = _MOD_PREFIX
     parts = []
-    for k, m in keys:
-        mod_val = _modifier(m)
-        prefix = ""
-        if mod_val & 0x01: prefix += "ctrl+"
-        if mod_val & 0x02: prefix += "shift+"
-        if mod_val & 0x04: prefix += "alt+"
-        if mod_val & 0x08: prefix += "meta+"
-        parts.append(f"{prefix}{k}")
+    for mod_val, kc in keys:
+        k = key_name[kc] or ("none" if kc == 0 else f"0x{kc:02x}")
+        parts.append(mod_prefix[mod_val & 0x0F] + k)
     if len(parts) == 1:
         return parts[0]
     return "[" + ", ".join(parts) + "]"
@@ -591,10 +964,10 @@ def open_device():
         dev.set_configuration()
     except usb.core.USBError as e:
         if e.errno == 16:  # Resource busy
-            for i in range(4):
+            # Only the interfaces the device actually has (alt settings share a number)
+            for i in sorted({intf.bInterfaceNumber for intf in dev.get_active_configuration()}):
                 try:
-                    if dev.is_kernel_driver_active(i):
-                        dev.detach_kernel_driver(i)
+                    dev.detach_kernel_driver(i)
                 except (NotImplementedError, usb.core.USBError):
                     pass
             try:
@@ -611,10 +984,23 @@ def open_device():
     except ValueError:
         ep_in = None  # read won't work but write still can
 
+    if usb1 is not None:
+        try:
+            ep_out, ep_in = open_async_endpoints(dev, ep_out, ep_in)
+        except usb1.USBError as e:
+            print(f"  libusb1 async I/O unavailable ({e}), using pyusb", file=sys.stderr)
+            ep_out = find_out_endpoint(dev)
+            try:
+                ep_in = find_in_endpoint(dev)
+            except ValueError:
+                ep_in = None
+
     print(f"  Device found: {VENDOR_ID:04x}:{PRODUCT_ID:04x}")
     print(f"  OUT endpoint: 0x{ep_out.bEndpointAddress:02x}")
     if ep_in:
         print(f"  IN endpoint:  0x{ep_in.bEndpointAddress:02x}")
+    if isinstance(ep_out, AsyncSender):
+        print("  Using libusb1 async transfers")
 
     return dev, ep_out, ep_in
 
@@ -625,7 +1011,7 @@ DEFAULT_CONFIG_PATH = "macropad.json"
 
 
 def main():
-    global DUMP_SENT_PACKETS
+    global DUMP_SENT_PACKETS, USE_LEGACY_DELAY, SAFE_COMMIT
 
     # Parse args
     args = sys.argv[1:]
@@ -639,9 +1025,15 @@ def main():
             i += 1
 
     if "--dump" in args:
-        DUMP_SENT_PACKETS = "macropad_sent_packets.hex"
-        open(DUMP_SENT_PACKETS, "w").close()
-        print(f"  Dumping sent packets to {DUMP_SENT_PACKETS}")
+        dump_path = "macropad_sent_packets.hex"
+        DUMP_SENT_PACKETS = open(dump_path, "w", buffering=64 * 1024)
+        atexit.register(DUMP_SENT_PACKETS.close)
+        print(f"  Dumping sent packets to {dump_path}")
+
+    if "--legacy-delay" in args:
+        USE_LEGACY_DELAY = True
+    if "--safe-commit" in args:
+        SAFE_COMMIT = True
 
     # --generate-config: write default JSON and exit
     if "--generate-config" in args:
@@ -671,7 +1063,7 @@ def main():
         leds = {layer: (effect, color) for layer in range(1, NUM_LAYERS + 1)}
         dev, ep_out, ep_in = open_device()
         print("  Setting LEDs (all layers)...")
-        write_all_layer_configs(ep_out, list(range(1, NUM_LAYERS + 1)), leds=leds, led_only=True)
+        write_all_layer_configs(ep_out, list(range(1, NUM_LAYERS + 1)), leds=leds, led_only=True, ep_in=ep_in)
         save_to_board(ep_out)
         print("\n  Done.")
         return
@@ -690,7 +1082,7 @@ def main():
         print("  No layers/bindings found in config.", file=sys.stderr)
         sys.exit(1)
 
-    total_bindings = sum(len(b) for b in config.values())
+    total_bindings = sum(len(b) for _, b in config)
     extras = []
     if leds:
         extras.append(f"{len(leds)} LED setting(s)")
@@ -700,7 +1092,7 @@ def main():
     print(f"  {len(config)} layer(s), {total_bindings} binding(s) to write{extra_msg}")
 
     dev, ep_out, ep_in = open_device()
-    program_from_config(ep_out, config, leds=leds, delays=delays)
+    program_from_config(ep_out, config, leds=leds, delays=delays, ep_in=ep_in)
     save_to_board(ep_out)
 
     # Verify writes by reading back layer 1 knob buttons
@@ -710,16 +1102,16 @@ def main():
         try:
             readback = read_all_buttons(ep_out, ep_in, 1)
             # Check a few buttons to confirm writes took effect
-            if 1 in config:
-                for btn_id, expected_keys in config[1]:
+            layer1 = dict(config).get(1)
+            if layer1 is not None:
+                for btn_id, expected_keys in layer1:
                     if btn_id not in readback:
                         continue
                     btype, actual_keys = readback[btn_id]
                     if len(expected_keys) == 1:
-                        exp_kc = _keycode(expected_keys[0][0])
-                        exp_mod = _modifier(expected_keys[0][1])
+                        exp_mod, exp_kc = expected_keys[0]
                         if actual_keys and (actual_keys[0] != (exp_mod, exp_kc)):
-                            btn_name = _BUTTON_ID_TO_NAME.get(btn_id, f"0x{btn_id:02x}")
+                            btn_name = _BUTTON_ID_TO_NAME[btn_id] or f"0x{btn_id:02x}"
                             actual_str = f"mod=0x{actual_keys[0][0]:02x} key=0x{actual_keys[0][1]:02x}"
                             expected_str = f"mod=0x{exp_mod:02x} key=0x{exp_kc:02x}"
                             print(f"    WARNING: {btn_name}: expected {expected_str}, got {actual_str}")